@@ -1,59 +1,218 @@
 import ast
+import hashlib
+import json
 import logging
+import mmap
 import os
 import traceback
-from typing import Set, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+from typing import Any, Callable, Dict, FrozenSet, Iterator, List, Optional, Set, Tuple
 
 from pipreqs.pipreqs import join
 
 logger = logging.getLogger("packages_inspector")
 
+# Directories not explored when looking for python files
+IGNORE_DIRS = frozenset({".hg", ".svn", ".git", ".mypy_cache", ".tox", "__pycache__", "env", "venv", "node_modules"})
 
-def get_all_imports(path: str) -> Tuple[Set[str], Set[str]]:
+# Minimum number of python files for the parsing to be spread over multiple processes,
+# also used as the size of the chunks of files sent to each process
+PARALLEL_PARSING_THRESHOLD = 32
+
+# Size in bytes from which a python file is memory mapped instead of being read
+MMAP_THRESHOLD = 64 * 1024
+
+# Version of the format of the parse cache and of the rules used to extract the imports,
+# to be bumped whenever one of them changes so that the previous caches are ignored
+PARSE_CACHE_VERSION = 1
+
+
+@lru_cache(maxsize=1)
+def _stdlib_modules() -> FrozenSet[str]:
+    """ Returns the modules of the standard library, as listed by pipreqs """
+    with open(join("stdlib"), "r") as f:
+        return frozenset(x.strip() for x in f)
+
+
+def _scan_codebase(path: str) -> Tuple[List[str], List[str]]:
+    """ Given a path, returns a tuple
+        with the names of the directories and python files (candidates to be local modules),
+        and the list of the paths of the python files """
+    candidates = [os.path.basename(path)]
+    file_names = []
+
+    # Explicit stack of directories based on os.scandir, the DirEntry objects cache
+    # the file type so this spares the extra stat calls and joins done by os.walk
+    stack = [path]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except OSError as exc:
+            logger.debug(f"skipping {exc.filename}: {exc.strerror}")
+            continue
+
+        with entries:
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if is_dir:
+                    if entry.name not in IGNORE_DIRS:
+                        candidates.append(entry.name)
+                        stack.append(entry.path)
+                elif entry.name.endswith(".py"):
+                    candidates.append(entry.name[:-3])
+                    file_names.append(entry.path)
+
+    return candidates, file_names
+
+
+def _iter_statements(tree: ast.Module) -> Iterator[ast.AST]:
+    """ Yields all the statements of a tree, including the nested ones,
+        without going through the expressions which can't hold any import """
+    stack: List[ast.AST] = list(tree.body)
+    while stack:
+        node = stack.pop()
+        yield node
+        for field in ("body", "orelse", "finalbody", "handlers", "cases"):
+            stack.extend(getattr(node, field, ()))
+
+
+def _import_names(node: ast.Import) -> Iterator[str]:
+    for subnode in node.names:
+        logger.debug(f"found {subnode.name=}")
+        yield subnode.name
+
+
+def _import_from_names(node: ast.ImportFrom) -> Iterator[str]:
+    if node.module:
+        logger.debug(f"found {node.module=}")
+        if node.level > 0:
+            logger.debug(f"ignore {node.module=} because {node.level=}")
+        else:
+            yield node.module
+
+
+# Functions yielding the names of the imported modules, indexed by the exact type of the import statements,
+# a single dict lookup is cheaper than testing each statement against each type with isinstance
+_IMPORT_HANDLERS: Dict[type, Callable[[Any], Iterator[str]]] = {
+    ast.Import: _import_names,
+    ast.ImportFrom: _import_from_names,
+}
+
+
+def _extract_imports(file_name: str, contents: bytes, ignore_errors: bool = False) -> Set[str]:
+    """ Returns the raw names of the modules imported in a python file """
+    raw_imports: Set[str] = set()
+    try:
+        tree = ast.parse(contents, filename=file_name)
+        for node in _iter_statements(tree):
+            if handler := _IMPORT_HANDLERS.get(type(node)):
+                raw_imports.update(handler(node))
+    except Exception as exc:
+        if ignore_errors:
+            traceback.print_exc()
+            logger.warn("Failed on file: %s" % file_name)
+        else:
+            logger.error("Failed on file: %s" % file_name)
+            raise exc
+    return raw_imports
+
+
+def _load_parse_cache(parse_cache_file: str) -> Dict[str, Set[str]]:
+    """ Returns the imports found in the files during the previous run,
+        indexed by the sha256 digest of the content of the files """
+    if not os.path.exists(parse_cache_file):
+        return {}
+
+    logger.debug(f"loading {parse_cache_file}")
+    try:
+        with open(parse_cache_file, "r", encoding="utf-8") as f:
+            content = json.load(f)
+        if content["version"] != PARSE_CACHE_VERSION:
+            logger.debug(f"ignoring {parse_cache_file} built with the version {content['version']} of the cache")
+            return {}
+        return {digest: set(imports) for digest, imports in content["imports"].items()}
+    except Exception as err:
+        logger.warning(f"could not load {parse_cache_file}, it will be rebuilt: {err}")
+        return {}
+
+
+def _save_parse_cache(parse_cache_file: str, parse_cache: Dict[str, Set[str]]) -> None:
+    content = {
+        "version": PARSE_CACHE_VERSION,
+        "imports": {digest: sorted(imports) for digest, imports in parse_cache.items()},
+    }
+    with open(parse_cache_file, "w", encoding="utf-8") as f:
+        json.dump(content, f)
+    logger.debug(f"{parse_cache_file} saved")
+
+
+def _read_file(file_name: str, parse_cache: Dict[str, Set[str]]) -> Tuple[str, Optional[bytes]]:
+    """ Returns the sha256 digest of the content of a file,
+        and the content itself if the digest is not found in the given cache """
+    logger.debug(f"reading {file_name}")
+    with open(file_name, "rb") as f:
+        if os.fstat(f.fileno()).st_size < MMAP_THRESHOLD:
+            contents = f.read()
+            digest = hashlib.sha256(contents).hexdigest()
+            return digest, None if digest in parse_cache else contents
+
+        # Big files are hashed straight from the memory mapping,
+        # and only copied if they need to be parsed
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            digest = hashlib.sha256(mapped).hexdigest()
+            return digest, None if digest in parse_cache else mapped[:]
+
+
+def _parse_files(file_names: List[str], parse_cache: Dict[str, Set[str]], ignore_errors: bool) -> Dict[str, Set[str]]:
+    """ Returns the raw imports of each file, indexed by the sha256 digest of its content,
+        only the files not found in the given cache are parsed """
+    raw_imports_by_digest = {}
+    names_to_parse, digests_to_parse, contents_to_parse = [], [], []
+    for file_name in file_names:
+        digest, contents = _read_file(file_name, parse_cache)
+        if contents is None:
+            logger.debug(f"{file_name} unchanged since the previous run")
+            raw_imports_by_digest[digest] = parse_cache[digest]
+        else:
+            names_to_parse.append(file_name)
+            digests_to_parse.append(digest)
+            contents_to_parse.append(contents)
+
+    extract_imports = partial(_extract_imports, ignore_errors=ignore_errors)
+    if len(names_to_parse) < PARALLEL_PARSING_THRESHOLD:
+        # Not worth the cost of spawning the worker processes
+        raw_imports_by_digest.update(zip(digests_to_parse, map(extract_imports, names_to_parse, contents_to_parse)))
+    else:
+        with ProcessPoolExecutor() as executor:
+            parsed = executor.map(
+                extract_imports, names_to_parse, contents_to_parse, chunksize=PARALLEL_PARSING_THRESHOLD
+            )
+            raw_imports_by_digest.update(zip(digests_to_parse, parsed))
+    return raw_imports_by_digest
+
+
+def get_all_imports(path: str, parse_cache_file: Optional[str] = None) -> Tuple[Set[str], Set[str]]:
     """ Given a path, returns a tuple
         with the list of modules only imported,
-        and the list of modules both defined and imported """
+        and the list of modules both defined and imported
+
+        If a parse cache file is given, only the files modified since the previous run are parsed """
     imports = set()
-    raw_imports = set()
-    candidates = []
     ignore_errors = False
-    ignore_dirs = [".hg", ".svn", ".git", ".mypy_cache", ".tox", "__pycache__", "env", "venv", "node_modules"]
-
-    walk = os.walk(path, followlinks=True)
-    for root, dirs, files in walk:
-        dirs[:] = [d for d in dirs if d not in ignore_dirs]
-
-        candidates.append(os.path.basename(root))
-        files = [fn for fn in files if os.path.splitext(fn)[1] == ".py"]
-
-        candidates += [os.path.splitext(fn)[0] for fn in files]
-        for file_name in files:
-            file_name = os.path.join(root, file_name)
-            with open(file_name, "r", encoding="utf-8") as f:
-                logger.debug(f"reading {file_name}")
-                contents = f.read()
-            try:
-                tree = ast.parse(contents)
-                for node in ast.walk(tree):
-                    if isinstance(node, ast.Import):
-                        for subnode in node.names:
-                            logger.debug(f"found {subnode.name=}")
-                            raw_imports.add(subnode.name)
-
-                    elif isinstance(node, ast.ImportFrom) and node.module:
-                        logger.debug(f"found {node.module=}")
-                        if node.level > 0:
-                            logger.debug(f"ignore {node.module=} because {node.level=}")
-                        else:
-                            raw_imports.add(node.module)
-            except Exception as exc:
-                if ignore_errors:
-                    traceback.print_exc()
-                    logger.warn("Failed on file: %s" % file_name)
-                    continue
-                else:
-                    logger.error("Failed on file: %s" % file_name)
-                    raise exc
+
+    candidates, file_names = _scan_codebase(path)
+
+    parse_cache = _load_parse_cache(parse_cache_file) if parse_cache_file else {}
+    raw_imports_by_digest = _parse_files(file_names, parse_cache, ignore_errors)
+    if parse_cache_file:
+        # Only the digests of the current files are kept so that the cache doesn't grow forever
+        _save_parse_cache(parse_cache_file, raw_imports_by_digest)
+
+    raw_imports = set().union(*raw_imports_by_digest.values())
 
     # Clean up imports
     for name in [n for n in raw_imports if n]:
@@ -73,7 +232,6 @@ def get_all_imports(path: str) -> Tuple[Set[str], Set[str]]:
     modules = imports - locally_defined_modules
     logger.debug(f"{modules=}")
 
-    with open(join("stdlib"), "r") as f:
-        standard_modules = {x.strip() for x in f}
+    standard_modules = _stdlib_modules()
 
     return modules - standard_modules, locally_defined_modules - standard_modules
@@ -1,18 +1,27 @@
 import logging
-import subprocess
-import sys
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum, auto
 from functools import lru_cache
+from pathlib import Path
 from typing import Callable, Dict, Optional, Set
 
 import requests
-import textdistance  # type: ignore
+from rapidfuzz import fuzz, process
+from rapidfuzz.utils import default_process
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 logger = logging.getLogger("packages_inspector")
 
 
 MODULE_IGNORED = "module-ignored"
 
+# Maximum number of concurrent requests to pypi
+PYPI_MAX_WORKERS = 16
+
+# Timeout in seconds of the requests to pypi
+PYPI_TIMEOUT = 5
+
 
 class NoPackageFound(Exception):
     pass
@@ -22,28 +31,85 @@ class ModuleIgnored(Exception):
     pass
 
 
-@lru_cache
+# A single session so that the connections to pypi are reused instead of doing a TLS handshake per request
+_pypi_session = requests.Session()
+_pypi_session.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=PYPI_MAX_WORKERS,
+        pool_maxsize=PYPI_MAX_WORKERS,
+        max_retries=Retry(total=2, backoff_factor=0.3),
+    ),
+)
+
+# Packages known to exist on pypi, packages don't disappear from pypi so this can be kept across runs
+_existing_packages: Set[str] = set()
+
+
+def load_existing_packages(path: Path) -> None:
+    if path.exists():
+        logger.debug(f"loading the packages known to exist from {path}")
+        with open(path, "r") as f:
+            _existing_packages.update(line.strip() for line in f if line.strip())
+
+
+def save_existing_packages(path: Path) -> None:
+    with open(path, "w") as f:
+        f.writelines(f"{package}\n" for package in sorted(_existing_packages))
+    logger.debug(f"packages known to exist saved to {path}")
+
+
+@lru_cache(maxsize=None)
 def _package_exists(package: str) -> bool:
-    exists = requests.get(f"https://pypi.org/pypi/{package}/json").status_code == 200
+    if package in _existing_packages:
+        return True
+    # Only the status code matters, there is no need to download the metadata
+    response = _pypi_session.head(f"https://pypi.org/pypi/{package}/json", allow_redirects=True, timeout=PYPI_TIMEOUT)
+    exists = response.status_code == 200
     logger.debug(f"{package=} {exists=}")
+    if exists:
+        _existing_packages.add(package)
     return exists
 
 
-def _pip_search_packages(query: str) -> Set[str]:
-    """ Returns the list of found packages on pypi """
-    return {
-        line.split(" ")[0]
-        for line in subprocess.run(
-            f"{sys.executable} -m pip search {query}".split(" "), capture_output=True, text=True
-        ).stdout.split("\n")
-        if line
-    }
+def _prefetch_package_existence(package: str) -> None:
+    # Failures are only logged, the failed checks aren't cached and will be retried if the answer is ever needed
+    try:
+        _package_exists(package)
+    except requests.RequestException as err:
+        logger.debug(f"could not check in advance if {package=} exists: {err}")
+
+
+def prefetch_packages_existence(
+    modules: Set[str], module_to_package_mapping: Dict[str, str], normalized_requirements: Dict[str, str]
+) -> None:
+    """ Concurrently checks the existence of the packages best_package_choice is likely to check:
+        the explicitly mapped packages, and the modules not found in the requirements """
+    packages = {
+        module_to_package_mapping.get(module, module)
+        for module in modules
+        if module in module_to_package_mapping or canonical_name(module) not in normalized_requirements
+    } - {MODULE_IGNORED}
+    with ThreadPoolExecutor(max_workers=PYPI_MAX_WORKERS) as executor:
+        # The results are kept by the cache of _package_exists
+        list(executor.map(_prefetch_package_existence, packages))
+
+
+def canonical_name(name: str) -> str:
+    """ Returns the name of a module or a package in a form that can be compared to others:
+        lowercased, with any non alphanumeric character turned into a space, and trimmed """
+    return default_process(name)
+
+
+def normalize_requirements(packages_in_requirements: Set[str]) -> Dict[str, str]:
+    """ Returns the packages in the requirements indexed by their canonical name,
+        to be done once for all the modules """
+    return {canonical_name(package): package for package in packages_in_requirements}
 
 
 class MappingFinder(Enum):
     ExplicitMapping = auto()
     UsingRequirements = auto()
-    UsingPipSearch = auto()
     UsingDumbAssumption = auto()
 
 
@@ -60,52 +126,31 @@ def _find_package_explicit_mapping(module: str, module_to_package_mapping: Dict[
 
 def _find_package_using_requirements(
     module: str,
-    distance_threshold: int,
-    packages_in_requirements: Set[str],
+    score_cutoff: float,
+    normalized_requirements: Dict[str, str],
     interaction_hook: Callable[[MappingFinder, str, str], Optional[str]],
 ) -> str:
-    # Find in already provided requirements via text distance algorithms
-    if not packages_in_requirements:
+    # Find in already provided requirements via a fuzzy string matching
+    if not normalized_requirements:
         raise NoPackageFound()
 
-    for algorithm in {
-        textdistance.lcsstr,
-        textdistance.lcsseq,
-        textdistance.ratcliff_obershelp,
-        textdistance.cosine,
-    }:
-        matches = sorted(packages_in_requirements, key=lambda x: algorithm.normalized_distance(x, module))
-        package = matches[0]
-        distance = algorithm.distance(package, module)
-        if distance < distance_threshold:
-            logger.debug(f"mapped {module=} with {package=} using the defined requirements ({algorithm=} {distance=})")
-            if valid_package := interaction_hook(MappingFinder.UsingRequirements, module, package):
-                return valid_package
-        else:
-            logger.debug(f"{algorithm=} no corresponding package in the requirements with an acceptable distance ")
-    raise NoPackageFound()
-
+    processed_module = canonical_name(module)
+
+    # Most of the modules share their name with their package, there is no need for a fuzzy matching then
+    if package := normalized_requirements.get(processed_module):
+        logger.debug(f"mapped {module=} with {package=} using the defined requirements (same name)")
+    elif match := process.extractOne(
+        processed_module, normalized_requirements.keys(), scorer=fuzz.WRatio, processor=None, score_cutoff=score_cutoff
+    ):
+        processed_package, score, _ = match
+        package = normalized_requirements[processed_package]
+        logger.debug(f"mapped {module=} with {package=} using the defined requirements ({score=})")
+    else:
+        logger.debug("no corresponding package in the requirements with an acceptable score")
+        raise NoPackageFound()
 
-def _find_package_using_pip_search(
-    module: str, distance_threshold: int, interaction_hook: Callable[[MappingFinder, str, str], Optional[str]],
-) -> str:
-    # Find via a pip search (not super reliable)
-    query = module.replace("_", " ")
-    packages = _pip_search_packages(query)
-    if packages:
-        matches = sorted(packages, key=lambda x: textdistance.hamming.distance(x, module))
-        package = matches[0]
-        distance = textdistance.hamming.distance(package, module)
-        if distance < distance_threshold:
-            if len(packages) >= 100:
-                logger.warning(
-                    f"mapped {module=} with {package=} using a pip search ({distance=}) "
-                    f"(WARNING: the results have been truncated)"
-                )
-            else:
-                logger.debug(f"mapped {module=} with {package=} using a pip search ({distance=})")
-            if valid_package := interaction_hook(MappingFinder.UsingPipSearch, module, package):
-                return valid_package
+    if valid_package := interaction_hook(MappingFinder.UsingRequirements, module, package):
+        return valid_package
     raise NoPackageFound()
 
 
@@ -123,10 +168,10 @@ def _find_package_using_dumb_assumption(
 def best_package_choice(
     module: str,
     module_to_package_mapping: Dict[str, str],
-    packages_in_requirements: Set[str],
+    normalized_requirements: Dict[str, str],
     interaction_hook: Callable[[MappingFinder, str, str], Optional[str]],
     pypi_calls: bool,
-    distance_threshold: int = 20,
+    score_cutoff: float = 50,
 ) -> str:
     try:
         while True:
@@ -136,18 +181,10 @@ def best_package_choice(
                 pass
 
             try:
-                return _find_package_using_requirements(
-                    module, distance_threshold, packages_in_requirements, interaction_hook
-                )
+                return _find_package_using_requirements(module, score_cutoff, normalized_requirements, interaction_hook)
             except NoPackageFound:
                 pass
 
-            if pypi_calls:
-                try:
-                    return _find_package_using_pip_search(module, distance_threshold, interaction_hook)
-                except NoPackageFound:
-                    pass
-
             try:
                 return _find_package_using_dumb_assumption(module, interaction_hook, pypi_calls)
             except NoPackageFound:
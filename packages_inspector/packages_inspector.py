@@ -1,6 +1,9 @@
 import configparser
 import logging
+import os
 import re
+import shutil
+import tempfile
 from pathlib import Path
 from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
 
@@ -10,17 +13,39 @@ from pipreqs.pipreqs import parse_requirements  # type: ignore
 
 from .discovery import get_all_imports
 from .logging import ColorFormatter, TyperHandler
-from .mapping import MODULE_IGNORED, MappingFinder, ModuleIgnored, NoPackageFound, best_package_choice
+from .mapping import (
+    MODULE_IGNORED,
+    MappingFinder,
+    ModuleIgnored,
+    NoPackageFound,
+    best_package_choice,
+    canonical_name,
+    load_existing_packages,
+    normalize_requirements,
+    prefetch_packages_existence,
+    save_existing_packages,
+)
 from .recorder import DummyRecorder, FileRecorder, MappingRecorder
 
+# The libyaml based loader and dumper are much faster, but libyaml might not be available
+try:
+    from yaml import CSafeDumper as _YamlDumper
+    from yaml import CSafeLoader as _YamlLoader
+except ImportError:
+    from yaml import SafeDumper as _YamlDumper  # type: ignore
+    from yaml import SafeLoader as _YamlLoader  # type: ignore
+
 logger = logging.getLogger("packages_inspector")
 
 app = typer.Typer()
 
+# Package name at the beginning of a line of a requirements file
+_REQUIREMENTS_PACKAGE_RE = re.compile(r"^\s*([^#\s~=<>]+)", re.ASCII)
+
 
 def _keep_only_names(packages: Iterable[Dict[str, str]]) -> Set[str]:
     """ Returns a set of package names based on an iterable """
-    return set(package["name"].split("[")[0] for package in packages)
+    return {package["name"].partition("[")[0] for package in packages}
 
 
 class UnableToFindMapping(Exception):
@@ -32,9 +57,7 @@ class UnableToFindMapping(Exception):
 def automatic_package_validation(mapping_finder: MappingFinder, module: str, package: str) -> str:
     # If the proposed package comes from the requirements file, and that the package
     # name almost matches the module name, we assume it's the right one
-    if mapping_finder == MappingFinder.UsingRequirements and module.lower().replace(
-        "-", "_"
-    ) == package.lower().replace("-", "_"):
+    if mapping_finder == MappingFinder.UsingRequirements and canonical_name(module) == canonical_name(package):
         return package
     raise UnableToFindMapping(module)
 
@@ -82,13 +105,13 @@ def _load_context(path: Path) -> Dict[str, Any]:
     if path.exists():
         logger.debug("loading context")
         with open(path, "r") as f:
-            context = yaml.load(f, Loader=yaml.FullLoader)
+            context = yaml.load(f, Loader=_YamlLoader)
     return context
 
 
 def _save_context(path: Path, context: Dict[str, Any]) -> None:
     with open(path, "w") as f:
-        yaml.dump(context, f)
+        yaml.dump(context, f, Dumper=_YamlDumper)
     logger.debug("context saved")
 
 
@@ -111,7 +134,7 @@ def _inspect(
     logger.debug(f"{ignore_module_set=}")
 
     extra_module_cleaned_set = (
-        set(map(lambda x: x.partition(".")[0], extra_module)) | set(context.get("extra_modules", []))
+        {module.partition(".")[0] for module in extra_module} | set(context.get("extra_modules", []))
     ) - ignore_module_set
     logger.debug(f"{extra_module_cleaned_set=}")
 
@@ -126,13 +149,20 @@ def _inspect(
 
     extra_package_set = set(context.get("extra_packages", [])) | set(extra_package)
 
+    normalized_requirements = normalize_requirements(packages_in_requirements)
+
+    if pypi_calls:
+        prefetch_packages_existence(
+            required_modules | imported_and_defined_modules, module_to_package_mapping, normalized_requirements
+        )
+
     logger.info("Mapping all the modules with the corresponding packages...")
     try:
         required_packages_mapping = {
             module: recorder.record_mapping(
                 module,
                 best_package_choice(
-                    module, module_to_package_mapping, packages_in_requirements, interaction_hook, pypi_calls
+                    module, module_to_package_mapping, normalized_requirements, interaction_hook, pypi_calls
                 ),
             )
             for module in required_modules
@@ -146,13 +176,17 @@ def _inspect(
                 best_package_choice(
                     module,
                     {**module_to_package_mapping, **required_packages_mapping},
-                    packages_in_requirements,
+                    normalized_requirements,
                     interaction_hook,
                     pypi_calls,
                 ),
             )
-            for module in imported_and_defined_modules
+            for module in imported_and_defined_modules - required_modules
         }
+        # The ones also required (via the extra modules) have already been mapped
+        conflicting_packages_mapping.update(
+            {module: required_packages_mapping[module] for module in imported_and_defined_modules & required_modules}
+        )
         conflicting_packages = set(
             package for package in conflicting_packages_mapping.values() if package != MODULE_IGNORED
         )
@@ -161,7 +195,7 @@ def _inspect(
         raise typer.Exit(code=1)
     logger.info("Mapping done")
 
-    final_mapping = {**conflicting_packages_mapping, **required_packages_mapping, **conflicting_packages_mapping}
+    final_mapping = {**required_packages_mapping, **conflicting_packages_mapping}
     final_mapping_cleaned = {module: package for module, package in final_mapping.items() if package != MODULE_IGNORED}
     ignore_module_set |= set(module for module, package in final_mapping.items() if package == MODULE_IGNORED)
 
@@ -195,10 +229,7 @@ def _inspect(
 
 
 def _get_package_in_line(line: str) -> Optional[str]:
-    matches = re.match(r"^\s*([^#\s~=<>]*).*$", line)
-    if matches:
-        return matches.group(1)
-    return None
+    return matches.group(1) if (matches := _REQUIREMENTS_PACKAGE_RE.match(line)) else None
 
 
 def _output_results(
@@ -234,14 +265,20 @@ def _apply_results(
 
     if unused_packages:
         if requirements:
-            with open(requirements, "r") as f:
-                lines = f.readlines()
-            with open(requirements, "w") as f:
-                f.writelines(
-                    line
-                    for line in lines
-                    if (package := _get_package_in_line(line)) is None or package not in unused_packages
-                )
+            # The lines are streamed to a temporary file which then atomically replaces the requirements
+            tmp = tempfile.NamedTemporaryFile("w", dir=requirements.parent, delete=False)
+            try:
+                with open(requirements, "r") as f, tmp:
+                    tmp.writelines(
+                        line
+                        for line in f
+                        if (package := _get_package_in_line(line)) is None or package not in unused_packages
+                    )
+                shutil.copymode(requirements, tmp.name)
+                os.replace(tmp.name, requirements)
+            except BaseException:
+                os.unlink(tmp.name)
+                raise
         elif pipfile:
             raise NotImplementedError()
 
@@ -252,6 +289,13 @@ def packages_inspector(
     verbose: bool = typer.Option(False, "--verbose", "-v", help="Also print the debug logs"),
     context_file: Path = typer.Option(Path(".packages-inspector.yaml"), help="Path to the yaml context file"),
     update_context_file: bool = typer.Option(True, help="Update the context file based on the current run"),
+    parse_cache_file: Path = typer.Option(
+        Path(".packages-inspector.parse-cache"), help="Path to the cache of the imports found in each python file"
+    ),
+    parse_cache: bool = typer.Option(True, help="Only parse the python files modified since the previous run"),
+    existing_packages_file: Path = typer.Option(
+        Path(".packages-inspector.pypi-cache"), help="Path to the cache of the packages known to exist on pypi"
+    ),
     pipfile: Optional[Path] = typer.Option(None, help="Specify a Pipfile as a reference"),
     requirements: Optional[Path] = typer.Option(None, help="Specify a requirements as a reference"),
     error_on_diff: bool = typer.Option(
@@ -263,9 +307,7 @@ def packages_inspector(
     mapping: List[str] = typer.Option(None, "--mapping", "-m", help="Explicit mapping in the form module:package"),
     keep_package: List[str] = typer.Option(None, help="Add a package that is considered required anyhow"),
     interaction: bool = typer.Option(True, help="Allow or disallow interactions"),
-    pypi_calls: bool = typer.Option(
-        True, help="Enable or disable the calls to pypi to search for a package, or to search if a package exists"
-    ),
+    pypi_calls: bool = typer.Option(True, help="Enable or disable the calls to pypi to check if a package exists"),
     apply: bool = typer.Option(False, help="Apply the changes to the Pipfile or requirements file"),
 ) -> None:
     """
@@ -299,12 +341,17 @@ def packages_inspector(
     context = _load_context(context_file)
     logger.debug(f"{context=}")
 
+    if pypi_calls:
+        load_existing_packages(existing_packages_file)
+
     # Some of the mmaping decisions might have already been made in a previous run
     # but didn't end up in the context file. That's why there is this recorded here.
     recorder = FileRecorder()
 
     logger.info("Discovering all the modules of the codebase...")
-    only_imported_modules, imported_and_defined_modules = get_all_imports(path.as_posix())
+    only_imported_modules, imported_and_defined_modules = get_all_imports(
+        path.as_posix(), parse_cache_file.as_posix() if parse_cache else None
+    )
     logger.info(
         f"Found {len(only_imported_modules)} imported only modules, "
         f"and {len(imported_and_defined_modules)} both imported and defined modules."
@@ -347,6 +394,9 @@ def packages_inspector(
     if update_context_file:
         _save_context(context_file, context)
 
+    if pypi_calls:
+        save_existing_packages(existing_packages_file)
+
     recorder.clear()
 
     _output_results(potential_missing_packages, unused_packages, requirements, pipfile)
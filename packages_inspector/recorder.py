@@ -1,6 +1,6 @@
 import abc
+import json
 import logging
-import pickle
 from dataclasses import dataclass, field
 from pathlib import Path
 from typing import Dict
@@ -27,17 +27,33 @@ class MappingRecorder(_MappingRecorder, abc.ABC):
 
 @dataclass
 class FileRecorder(MappingRecorder):
+    """ Records the mappings in an append-only file, one json encoded (module, package) pair per line,
+        so that recording a mapping doesn't require to rewrite all the previous ones """
+
     records_file: str = ".mappings"
 
     def __post_init__(self) -> None:
         logger.debug(f"looking up {self.records_file}")
         if Path(self.records_file).exists():
+            invalid_records = False
             with open(self.records_file, "rb") as f:
-                try:
-                    self.records = pickle.load(f)
-                except Exception as err:
-                    logger.exception(f"could not load {self.records_file}: {err}")
-                    raise
+                for line in f:
+                    if not line.strip():
+                        continue
+                    # A run interrupted while recording a mapping leaves a truncated line,
+                    # and an older version of the tool used to write pickle data
+                    try:
+                        module, package = json.loads(line)
+                    except Exception as err:
+                        logger.warning(f"ignoring an invalid record in {self.records_file}: {err}")
+                        invalid_records = True
+                        continue
+                    self.records[module] = package
+
+            if invalid_records:
+                # Rewritten with the valid records only, so that the next ones aren't appended to an invalid line
+                with open(self.records_file, "w") as f:
+                    f.writelines(json.dumps([module, package]) + "\n" for module, package in self.records.items())
 
     def clear(self) -> None:
         if (path := Path(self.records_file)).exists():
@@ -46,8 +62,8 @@ class FileRecorder(MappingRecorder):
     def record_mapping(self, module: str, package: str) -> str:
         logger.debug(f"saving the mapping {module=} {package=}")
         self.records[module] = package
-        with open(self.records_file, "wb") as f:
-            pickle.dump(self.records, f)
+        with open(self.records_file, "a") as f:
+            f.write(json.dumps([module, package]) + "\n")
         return package
 
 
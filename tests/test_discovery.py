@@ -1,6 +1,11 @@
+import hashlib
+import json
+import os
+import pickle
+import tempfile
 import unittest
 
-from packages_inspector.discovery import get_all_imports
+from packages_inspector.discovery import PARALLEL_PARSING_THRESHOLD, PARSE_CACHE_VERSION, get_all_imports
 
 from . import test_project_path
 
@@ -10,3 +15,73 @@ class TestDiscovery(unittest.TestCase):
         only_imported_modules, imported_and_defined_modules = get_all_imports(test_project_path)
         self.assertEqual(only_imported_modules, {"requests"})
         self.assertEqual(imported_and_defined_modules, {"django"})
+
+    def test_large_project(self):
+        with tempfile.TemporaryDirectory() as project_path:
+            for i in range(PARALLEL_PARSING_THRESHOLD * 2):
+                with open(os.path.join(project_path, f"module_{i}.py"), "w") as f:
+                    f.write(f"import requests\nfrom module_{(i + 1) % PARALLEL_PARSING_THRESHOLD} import something\n")
+
+            only_imported_modules, imported_and_defined_modules = get_all_imports(project_path)
+            self.assertEqual(only_imported_modules, {"requests"})
+            self.assertEqual(imported_and_defined_modules, {f"module_{i}" for i in range(PARALLEL_PARSING_THRESHOLD)})
+
+    def test_nested_imports(self):
+        with tempfile.TemporaryDirectory() as project_path:
+            with open(os.path.join(project_path, "main.py"), "w") as f:
+                f.write(
+                    "try:\n"
+                    "    import yaml\n"
+                    "except ImportError:\n"
+                    "    yaml = None\n"
+                    "class Task:\n"
+                    "    def run(self):\n"
+                    "        if self:\n"
+                    "            from celery import shared_task\n"
+                    "        return lambda: shared_task\n"
+                )
+
+            only_imported_modules, imported_and_defined_modules = get_all_imports(project_path)
+            self.assertEqual(only_imported_modules, {"yaml", "celery"})
+            self.assertEqual(imported_and_defined_modules, set())
+
+    def test_parse_cache(self):
+        with tempfile.TemporaryDirectory() as project_path, tempfile.TemporaryDirectory() as cache_path:
+            parse_cache_file = os.path.join(cache_path, "parse-cache")
+            with open(os.path.join(project_path, "main.py"), "w") as f:
+                f.write("import requests\n")
+
+            only_imported_modules, _ = get_all_imports(project_path, parse_cache_file)
+            self.assertEqual(only_imported_modules, {"requests"})
+            self.assertTrue(os.path.exists(parse_cache_file))
+
+            only_imported_modules, _ = get_all_imports(project_path, parse_cache_file)
+            self.assertEqual(only_imported_modules, {"requests"})
+
+            with open(os.path.join(project_path, "main.py"), "w") as f:
+                f.write("import yaml\n")
+
+            only_imported_modules, _ = get_all_imports(project_path, parse_cache_file)
+            self.assertEqual(only_imported_modules, {"yaml"})
+
+    def test_invalid_parse_cache(self):
+        with tempfile.TemporaryDirectory() as project_path, tempfile.TemporaryDirectory() as cache_path:
+            parse_cache_file = os.path.join(cache_path, "parse-cache")
+            with open(os.path.join(project_path, "main.py"), "w") as f:
+                f.write("import requests\n")
+            digest = hashlib.sha256(b"import requests\n").hexdigest()
+
+            # Not json, the file is never unpickled
+            with open(parse_cache_file, "wb") as f:
+                pickle.dump({digest: {"yaml"}}, f)
+            only_imported_modules, _ = get_all_imports(project_path, parse_cache_file)
+            self.assertEqual(only_imported_modules, {"requests"})
+
+            # Built by another version of the cache
+            with open(parse_cache_file, "w") as f:
+                json.dump({"version": PARSE_CACHE_VERSION + 1, "imports": {digest: ["yaml"]}}, f)
+            only_imported_modules, _ = get_all_imports(project_path, parse_cache_file)
+            self.assertEqual(only_imported_modules, {"requests"})
+
+            with open(parse_cache_file, "r") as f:
+                self.assertEqual(json.load(f), {"version": PARSE_CACHE_VERSION, "imports": {digest: ["requests"]}})
@@ -1,9 +1,12 @@
 import logging
+import tempfile
 import unittest
+from pathlib import Path
 from typing import Optional
+from unittest import mock
 
 from packages_inspector.mapping import MappingFinder
-from packages_inspector.packages_inspector import _inspect
+from packages_inspector.packages_inspector import _apply_results, _inspect, automatic_package_validation
 
 
 def interaction_no_hook(mapping_finder: MappingFinder, module: str, package: str) -> Optional[str]:
@@ -35,3 +38,73 @@ class TestInpect(unittest.TestCase):
 
         self.assertEqual(potential_missing_packages, set())
         self.assertEqual(unused_packages, {"pyyaml"})
+
+    def test_fuzzy_requirements_mapping(self) -> None:
+        potential_missing_packages, unused_packages, context = _inspect(
+            only_imported_modules={"waffle", "yaml"},
+            imported_and_defined_modules=set(),
+            packages_in_requirements={"django-waffle", "PyYAML", "requests"},
+            interaction_hook=interaction_no_hook,
+        )
+
+        self.assertEqual(potential_missing_packages, set())
+        self.assertEqual(unused_packages, {"requests"})
+        self.assertEqual(context["mapping"], {"waffle": "django-waffle", "yaml": "PyYAML"})
+
+    def test_same_name_requirements_mapping(self) -> None:
+        potential_missing_packages, unused_packages, context = _inspect(
+            only_imported_modules={"django", "typing_extensions", "_ruamel_yaml"},
+            imported_and_defined_modules=set(),
+            packages_in_requirements={"Django", "typing-extensions", "ruamel.yaml", "django-waffle"},
+            interaction_hook=automatic_package_validation,
+        )
+
+        self.assertEqual(potential_missing_packages, set())
+        self.assertEqual(unused_packages, {"django-waffle"})
+        self.assertEqual(
+            context["mapping"],
+            {"django": "Django", "typing_extensions": "typing-extensions", "_ruamel_yaml": "ruamel.yaml"},
+        )
+
+    def test_extra_module_also_defined(self) -> None:
+        proposals = []
+
+        def interaction_recording_hook(mapping_finder: MappingFinder, module: str, package: str) -> Optional[str]:
+            proposals.append((module, package))
+            return package
+
+        potential_missing_packages, unused_packages, context = _inspect(
+            only_imported_modules=set(),
+            imported_and_defined_modules={"django"},
+            packages_in_requirements={"Django"},
+            extra_module=["django.contrib"],
+            interaction_hook=interaction_recording_hook,
+        )
+
+        self.assertEqual(proposals, [("django", "Django")])
+        self.assertEqual(potential_missing_packages, set())
+        self.assertEqual(unused_packages, set())
+        self.assertEqual(context["mapping"], {"django": "Django"})
+
+
+class TestApplyResults(unittest.TestCase):
+    def test_remove_unused_packages(self) -> None:
+        with tempfile.TemporaryDirectory() as requirements_path:
+            requirements = Path(requirements_path) / "requirements.txt"
+            requirements.write_text("-i https://pypi.org/simple\n# comment\nrequests==2.24.0\n\npyyaml>=5.3\ntyper\n")
+
+            _apply_results(set(), {"pyyaml", "typer"}, requirements, None)
+
+            self.assertEqual(requirements.read_text(), "-i https://pypi.org/simple\n# comment\nrequests==2.24.0\n\n")
+
+    def test_failed_removal_cleaned_up(self) -> None:
+        with tempfile.TemporaryDirectory() as requirements_path:
+            requirements = Path(requirements_path) / "requirements.txt"
+            requirements.write_text("requests==2.24.0\npyyaml>=5.3\n")
+
+            with mock.patch("os.replace", side_effect=OSError("replace failed")):
+                with self.assertRaises(OSError):
+                    _apply_results(set(), {"pyyaml"}, requirements, None)
+
+            self.assertEqual(list(Path(requirements_path).iterdir()), [requirements])
+            self.assertEqual(requirements.read_text(), "requests==2.24.0\npyyaml>=5.3\n")
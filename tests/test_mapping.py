@@ -0,0 +1,89 @@
+import logging
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import requests
+
+from packages_inspector import mapping
+from packages_inspector.mapping import (
+    _package_exists,
+    load_existing_packages,
+    normalize_requirements,
+    prefetch_packages_existence,
+    save_existing_packages,
+)
+
+
+def pypi_head(existing_packages):
+    def head(url, **kwargs):
+        package = url.split("/")[-2]
+        return mock.Mock(status_code=200 if package in existing_packages else 404)
+
+    return head
+
+
+class TestPackageExists(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        logging.getLogger().setLevel(logging.CRITICAL)
+        _package_exists.cache_clear()
+        self.addCleanup(_package_exists.cache_clear)
+
+        patcher = mock.patch.object(mapping, "_existing_packages", set())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = mock.patch.object(mapping._pypi_session, "head", side_effect=pypi_head({"requests", "pyyaml"}))
+        self.head = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_head_request(self):
+        self.assertTrue(_package_exists("requests"))
+        self.assertFalse(_package_exists("does-not-exist"))
+        self.head.assert_any_call(
+            "https://pypi.org/pypi/requests/json", allow_redirects=True, timeout=mapping.PYPI_TIMEOUT
+        )
+        self.assertEqual(mapping._existing_packages, {"requests"})
+
+    def test_existing_packages_saved_and_loaded(self):
+        with tempfile.TemporaryDirectory() as cache_path:
+            existing_packages_file = Path(cache_path) / "pypi-cache"
+            _package_exists("requests")
+            _package_exists("does-not-exist")
+            save_existing_packages(existing_packages_file)
+
+            mapping._existing_packages.clear()
+            _package_exists.cache_clear()
+            self.head.reset_mock()
+
+            load_existing_packages(existing_packages_file)
+            self.assertTrue(_package_exists("requests"))
+            self.head.assert_not_called()
+
+    def test_missing_existing_packages_file(self):
+        with tempfile.TemporaryDirectory() as cache_path:
+            load_existing_packages(Path(os.path.join(cache_path, "pypi-cache")))
+        self.assertEqual(mapping._existing_packages, set())
+
+    def test_prefetch_selection(self):
+        prefetch_packages_existence(
+            {"requests", "yaml", "waffle", "ignored"},
+            {"yaml": "pyyaml", "ignored": mapping.MODULE_IGNORED},
+            normalize_requirements({"requests", "django-waffle"}),
+        )
+
+        checked_packages = {call.args[0].split("/")[-2] for call in self.head.call_args_list}
+        self.assertEqual(checked_packages, {"pyyaml", "waffle"})
+        self.assertEqual(mapping._existing_packages, {"pyyaml"})
+
+    def test_prefetch_network_error(self):
+        self.head.side_effect = requests.ConnectionError("no network")
+
+        prefetch_packages_existence({"waffle"}, {}, {})
+
+        # Not cached, the check is done again when actually needed
+        self.head.side_effect = pypi_head({"waffle"})
+        self.assertTrue(_package_exists("waffle"))
@@ -0,0 +1,52 @@
+import os
+import pickle
+import tempfile
+import unittest
+
+from packages_inspector.recorder import FileRecorder
+
+
+class TestFileRecorder(unittest.TestCase):
+    def test_records_reloaded(self):
+        with tempfile.TemporaryDirectory() as records_path:
+            records_file = os.path.join(records_path, ".mappings")
+
+            recorder = FileRecorder(records_file=records_file)
+            self.assertEqual(recorder.record_mapping("yaml", "pyyaml"), "pyyaml")
+            recorder.record_mapping("waffle", "waffle")
+            recorder.record_mapping("waffle", "django-waffle")
+
+            self.assertEqual(
+                FileRecorder(records_file=records_file).records, {"yaml": "pyyaml", "waffle": "django-waffle"}
+            )
+
+            recorder.clear()
+            self.assertEqual(FileRecorder(records_file=records_file).records, {})
+
+    def test_torn_record_ignored(self):
+        with tempfile.TemporaryDirectory() as records_path:
+            records_file = os.path.join(records_path, ".mappings")
+
+            FileRecorder(records_file=records_file).record_mapping("yaml", "pyyaml")
+            with open(records_file, "a") as f:
+                f.write('["waf')
+
+            recorder = FileRecorder(records_file=records_file)
+            self.assertEqual(recorder.records, {"yaml": "pyyaml"})
+
+            recorder.record_mapping("waffle", "django-waffle")
+            self.assertEqual(
+                FileRecorder(records_file=records_file).records, {"yaml": "pyyaml", "waffle": "django-waffle"}
+            )
+
+    def test_pickled_records_ignored(self):
+        with tempfile.TemporaryDirectory() as records_path:
+            records_file = os.path.join(records_path, ".mappings")
+            with open(records_file, "wb") as f:
+                pickle.dump({"yaml": "pyyaml"}, f)
+
+            recorder = FileRecorder(records_file=records_file)
+            self.assertEqual(recorder.records, {})
+
+            recorder.record_mapping("waffle", "django-waffle")
+            self.assertEqual(FileRecorder(records_file=records_file).records, {"waffle": "django-waffle"})